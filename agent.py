@@ -2,10 +2,24 @@
 
 from dotenv import load_dotenv
 
+import asyncio
+import copy
+import hashlib
 import json
+import logging
 import os
+import random
+
+# orjson parses 2-5x faster than stdlib json and returns plain dicts/lists,
+# so it drops in transparently; fall back to stdlib when it isn't installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 import aiohttp
-from typing import Annotated, Any
+from typing import Annotated, ClassVar
 from livekit import api
 from livekit.agents import function_tool, RunContext
 
@@ -24,13 +38,20 @@ from livekit.plugins.turn_detector.english import EnglishModel
 # Load environment variables
 load_dotenv()
 
-# Defines the core behavior and capabilities of our voice assistant.
-class Assistant(Agent):
-    # The constructor initialises the agent with a set of instructions
-    def __init__(self) -> None:
-        super().__init__(instructions=f"""
+# Handlers are installed by agents.cli.run_app (job logs are forwarded over
+# IPC to the parent process). Messages use %s placeholders so formatting is
+# skipped entirely when the level is disabled.
+logger = logging.getLogger("outbound-caller")
+
+# The agent's full cold-call script, kept as a single module-level constant.
+# Providers key prompt caching on an exact byte-identical prefix, so the static
+# script must never be rebuilt or interpolated per call - any dynamic values
+# (callee name, timezone, ...) belong in a separate trailing message instead.
+# Keeping this byte-stable lets the provider's prompt cache skip the prefill of
+# the ~3KB prefix on every turn after the first.
+_SYSTEM_PROMPT_STATIC = """
     #Identity
-You are Caleb, seasoned cold caller for Vertex Media (https://www.vertexmedia.us). Your #1 job is to book the user into an appointment - without collecting their email while booking you have failed this job. You build rapport, adapt, qualify, and gain trust through natural conversation. Handle every excuse/objection with confidence. Speak in one clear sentence unless more is necessary. Strategically ask guiding questions to reveal pain points. Never use emojis. Don't repeat the user's input unless needed. Pronounce “leads” as "leeds". Keep control of the call. If someone asks if your AI say your one of Vertex's new innovative tools and ask q. Hang up if: any music is detected or what they're saying seems to be not responding to you for an extended period of time. Always focus on value proposition. Make it clear: Vertex doesn't just offer leads, but actual deals. YOU MUST ALWAYS address/go off their responses immediately (even after wait command). Always wait when instructed. 
+You are Caleb, seasoned cold caller for Vertex Media (https://www.vertexmedia.us). Your #1 job is to book the user into an appointment - without collecting their email while booking you have failed this job. You build rapport, adapt, qualify, and gain trust through natural conversation. Handle every excuse/objection with confidence. Speak in one clear sentence unless more is necessary. Strategically ask guiding questions to reveal pain points. Never use emojis. Don't repeat the user's input unless needed. Pronounce “leads” as "leeds". Keep control of the call. If someone asks if your AI say your one of Vertex's new innovative tools and ask q. Hang up if: any music is detected or what they're saying seems to be not responding to you for an extended period of time. Always focus on value proposition. Make it clear: Vertex doesn't just offer leads, but actual deals. YOU MUST ALWAYS address/go off their responses immediately (even after wait command). Always wait when instructed.
 
 #Script Frequently mix in filler words: “um,” “you know,” “like,” “I mean,” "so yeah” to sound more human 1.Intro “Hey is this Mustafa?? (MUST WAIT)(if they say their name first just skip this)
 “Awesome just Caleb here. Uh Hows it going today?" (high tone)(wait) (if they ask how you are say you're doing well)
@@ -41,11 +62,11 @@ If they say Who? “Just Caleb from Vertex, weve never actually spoken before”
 (wait)(heavily go off response)
 
 
-2.Pitch: 
+2.Pitch:
 “So I'm with a group called Vertex, and as i said weve actually been working with a lot of agents like yourself across the US. and you know, teams like Coldwell Banker and Colemere Realty.
 and to keep it simple, we get agents in front of homeowners who are already thinking about selling but just haven't listed yet. We actually take on the headache of um generating the leads, qualifying them based on your criteria, and handling all the follow-ups. From there, we book them straight into your calendar so all you have to do is step in and close. Its as simple as that and its all done by leveraging our new AI funnels, hyper targeted youtube ad campaigns, and most importantly our in house team, who are all former agents themselves. So, just to confirm, if we could guarantee you, you know, an extra 2 to 4 deals next month youd be able to take on the extra volume right?” (wait)(If they object handle it then move on. If no objections move to booking)
 
-“Great so um just so I understand , is your main goal right now getting more buyers, sellers, listings, or just whatever brings in the cash?” (wait/go off answer) 
+“Great so um just so I understand , is your main goal right now getting more buyers, sellers, listings, or just whatever brings in the cash?” (wait/go off answer)
 
 3. Booking: "Perfect so um, we'd love to just get to know you, show you the system, and really see if we'd be a good fit for each other. Does Tomorrow work for a quick zoom call or is the day after better?”
 
@@ -59,16 +80,87 @@ Say what fits based on chat, but here's guidance:
 *Can you send me an email/website/text me?*
 “Ya for sure no worries at all, and just so I know…what specifically are you looking for so I know what to send?” (wait/go off response) "Look um, I'm gonna be honest with you, from one business owner to another I'm not gonna waste either of our time and send you that email." (ONLY IF PITCHED): How about instead we set up a time to chat for a few minutes to ask each other any questions in real time, go over some testimonials, and at least then you'll know you explored your options. That sound good?" (wait).
 *Whats the cost/Upfront cost (before pitch)*
-*Whats the cost?/Is there an upfront cost?/I only work with referrals/commissions (after pitch)*( anything cost related refer to this)  “Ye so of course there is an investment, but to be honest It wouldn't be fair to give you a number yet, because we don't even know if we can help you yet. First, we'd need to learn more about your business and market, see where you're leaving money on the table, and figure out the best strategy for you. The next step is a quick call where we show you our system, walk you through everything, and break down the costs. But just so you have peace of mind though— if we can't deliver the results in the agreed time, we work for free until we do. Does that sound fair? 
+*Whats the cost?/Is there an upfront cost?/I only work with referrals/commissions (after pitch)*( anything cost related refer to this)  “Ye so of course there is an investment, but to be honest It wouldn't be fair to give you a number yet, because we don't even know if we can help you yet. First, we'd need to learn more about your business and market, see where you're leaving money on the table, and figure out the best strategy for you. The next step is a quick call where we show you our system, walk you through everything, and break down the costs. But just so you have peace of mind though— if we can't deliver the results in the agreed time, we work for free until we do. Does that sound fair?
 
-Only if they keep pushing for detail: Say something along the lines of while its risk free the cost depends on specific factors you'd have to discuss on a later meeting 
+Only if they keep pushing for detail: Say something along the lines of while its risk free the cost depends on specific factors you'd have to discuss on a later meeting
 *I'm already working with someone*
-"Totally understand — most people I speak with are. Can I ask, are you completely satisfied with them?" (play off answer) 
+"Totally understand — most people I speak with are. Can I ask, are you completely satisfied with them?" (play off answer)
 "So I'm just curious, if there was a way to add to what you're doing, without replacing anything, would it make sense to explore it?" (wait)
 
 
-    
-    """)
+
+    """
+
+# Stable fingerprint of the static prompt, computed once at import time.
+# Passed as the OpenAI-protocol prompt_cache_key on every LLM request so the
+# provider can key its prefix cache on it and skip re-prefilling the
+# ~800-token script each turn.
+_PROMPT_HASH = hashlib.blake2b(_SYSTEM_PROMPT_STATIC.encode(), digest_size=16).hexdigest()
+
+# S3 credentials and recording config, resolved once at import time rather
+# than per job - only the per-call filepath differs between jobs. Recording is
+# best-effort, so missing AWS env vars leave _S3_CONFIG unset and egress is
+# skipped (with a log line) rather than blocking the worker from starting.
+_AWS_ACCESS = os.environ.get("AWS_S3_ACCESS_KEY")
+_AWS_SECRET = os.environ.get("AWS_S3_SECRET_KEY")
+_S3_REGION = "eu-north-1"
+_S3_BUCKET = "livekit-calls"
+_S3_CONFIG = (
+    api.S3Upload(
+        access_key=_AWS_ACCESS,
+        secret=_AWS_SECRET,
+        region=_S3_REGION,
+        bucket=_S3_BUCKET,
+    )
+    if _AWS_ACCESS and _AWS_SECRET
+    else None
+)
+
+# Template for the outbound-dial request, built once at import. Constructing
+# protobuf messages through the Python bindings is surprisingly expensive
+# (field validation, default fill-in), so each call copies the template and
+# patches only the fields that differ per job.
+_SIP_TEMPLATE = api.CreateSIPParticipantRequest(
+    sip_trunk_id='ST_S5x7yXbF7QDH', # The specific SIP trunk to use.
+    wait_until_answered=True, # Wait for the call to be answered before proceeding.
+)
+
+# Parses the job metadata into a dict, tolerating missing or malformed input.
+# Kept as a helper so it runs exactly once per job, at the very top of the
+# entrypoint - bad metadata then fails fast before any expensive work
+# (room connect, egress start, SIP dial) has been done.
+def _parse_metadata(raw: str | None) -> dict:
+    if not raw:
+        return {}
+    try:
+        return _json_loads(raw)
+    except ValueError: # Covers both orjson.JSONDecodeError and json.JSONDecodeError.
+        logger.error("Invalid JSON in job metadata")
+        return {}
+
+# Returns the HTTP session shared by every job handled by this worker process.
+# Opening a ClientSession per tool call would pay a fresh TCP+TLS handshake each
+# time; a single keep-alive pool amortizes that to one handshake per host.
+# Created lazily because aiohttp sessions must be built on a running event loop.
+def _http_session(proc: agents.JobProcess) -> aiohttp.ClientSession:
+    if "http" not in proc.userdata:
+        proc.userdata["http"] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=75)
+        )
+    return proc.userdata["http"]
+
+# Defines the core behavior and capabilities of our voice assistant.
+class Assistant(Agent):
+    # The instructions live on the class, not the instance: every Assistant
+    # constructed on this worker passes the exact same interned string object
+    # by reference, so no per-construction copy or re-hash of the ~3KB script.
+    _INSTRUCTIONS: ClassVar[str] = _SYSTEM_PROMPT_STATIC
+
+    # The constructor initialises the agent with a set of instructions
+    def __init__(self, http: aiohttp.ClientSession | None = None) -> None:
+        # The shared HTTP session used by all tool methods; see _http_session above.
+        self.http = http
+        super().__init__(instructions=Assistant._INSTRUCTIONS)
     
     # This method is a tool that the agent can use to get the current weather.
     # The @function_tool decorator exposes this method to the agent's LLM,
@@ -88,32 +180,47 @@ Only if they keep pushing for detail: Say something along the lines of while its
 
     #     url = f"http://api.openweathermap.org/data/2.5/weather?q={location}&appid={api_key}&units=metric"
 
-    #     async with aiohttp.ClientSession() as session:
-    #         async with session.get(url) as response:
-    #             if response.status != 200:
-    #                 return f"Sorry, I couldn't get the weather. Status code: {response.status}"
-                
-    #             data = await response.json()
-                
-    #             if "weather" not in data or not data["weather"]:
-    #                 return "Sorry, I couldn't find any weather data for that location."
-                
-    #             description = data["weather"][0]["description"]
-    #             temp = data["main"]["temp"]
-                
-    #             return f"The weather in {location} is {description} with a temperature of {temp}°C."
+    #     # Reuse the worker's shared HTTP session rather than opening a new
+    #     # ClientSession (and paying a TCP+TLS handshake) on every call.
+    #     async with self.http.get(url) as response:
+    #         if response.status != 200:
+    #             return f"Sorry, I couldn't get the weather. Status code: {response.status}"
 
-# The entrypoint is the main function that runs when a new job for the agent starts.
-# It sets up the agent's connection to a LiveKit room and manages its lifecycle.
-async def entrypoint(ctx: agents.JobContext):
-    # Connect the agent to the LiveKit room associated with the job.
-    await ctx.connect()
+    #         data = await response.json()
 
-    # This block attempts to start a recording (egress) of the room's audio.
-    # The recording is saved to an S3 bucket.
-    try:
-        lkapi = api.LiveKitAPI()
+    #         if "weather" not in data or not data["weather"]:
+    #             return "Sorry, I couldn't find any weather data for that location."
+
+    #         description = data["weather"][0]["description"]
+    #         temp = data["main"]["temp"]
+
+    #         return f"The weather in {location} is {description} with a temperature of {temp}°C."
 
+# Runs once when a worker process starts, before it is handed any job.
+# Loading the Silero VAD (ONNX model + ORT session) and the turn-detector
+# model here instead of inside the entrypoint shaves their load cost off
+# every call's startup and shares the weights across jobs in this process.
+def prewarm(proc: agents.JobProcess):
+    proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["turn_detection"] = EnglishModel()
+    # The STT/TTS plugins pool their provider connections internally, so
+    # constructing them once per process (instead of per job) lets the
+    # WebSocket TCP+TLS+WS handshakes amortize across consecutive calls
+    # handled by this worker.
+    proc.userdata["stt"] = deepgram.STT()
+    proc.userdata["tts"] = cartesia.TTS(model="sonic-2", voice="73369e4c-fd0c-4f46-92db-01c7fc6ea830")
+
+# Starts an audio-only recording (egress) of the room, uploaded to S3.
+# Runs as a background task so its round-trip to LiveKit cloud overlaps with
+# the SIP dial instead of adding to the call-setup wall time. Failures are
+# logged but never block the call itself. Uses the job's shared ctx.api
+# client, so no per-call LiveKitAPI (and TLS handshake) is created or torn
+# down just for this request.
+async def _start_egress(ctx: agents.JobContext) -> None:
+    if _S3_CONFIG is None:
+        logger.warning("AWS S3 credentials not set; skipping call recording.")
+        return
+    try:
         req = api.RoomCompositeEgressRequest(
             room_name=ctx.room.name,
             audio_only=True,
@@ -121,68 +228,154 @@ async def entrypoint(ctx: agents.JobContext):
                 api.EncodedFileOutput(
                     file_type=api.EncodedFileType.OGG,
                     filepath=f"{ctx.room.name}.ogg",
-                    # S3 configuration for uploading the recording.
-                    s3=api.S3Upload(
-                        access_key=os.environ.get("AWS_S3_ACCESS_KEY"),
-                        secret=os.environ.get("AWS_S3_SECRET_KEY"),
-                        region="eu-north-1",
-                        bucket="livekit-calls"
-                    )
+                    # Shared S3 configuration for uploading the recording.
+                    s3=_S3_CONFIG,
                 )
             ],
         )
-        print("Starting room egress...")
-        egress_info = await lkapi.egress.start_room_composite_egress(req)
-        await lkapi.aclose()
+        logger.info("Starting room egress...")
+        egress_info = await ctx.api.egress.start_room_composite_egress(req)
         egress_id = getattr(egress_info, "egress_id", None) or getattr(egress_info, "egressId", None)
-        print(f"Egress started successfully. Egress ID: {egress_id}")
+        logger.info("Egress started successfully. Egress ID: %s", egress_id)
     except Exception as e:
-        print(f"Error starting egress: {e}")
+        logger.error("Error starting egress: %s", e)
 
-    # Check for a phone number in the job metadata to determine if this is an outbound call.
-    phone_number = None
-    if ctx.job.metadata:
+# Opens the network connections to the STT/TTS providers ahead of the first
+# conversational turn. Without this, the TLS + WebSocket handshakes (~200-400ms)
+# are paid lazily on the first user utterance - right after the callee says "hello".
+# Warming them while the SIP dial is in flight means the first turn only pays
+# audio-frame latency. Both plugins expose the public prewarm() hook for exactly
+# this; the LLM's prewarm() is already invoked by AgentSession itself.
+async def warm_providers(session: AgentSession) -> None:
+    for component in (session.stt, session.tts):
+        if component is None:
+            continue
         try:
-            metadata = json.loads(ctx.job.metadata)
-            phone_number = metadata.get("phone_number")
-        except json.JSONDecodeError:
-            print("Error: Invalid JSON in job metadata")
-
-    # If a phone number is provided, initiate an outbound SIP call.
-    if phone_number:
-        print(f"Attempting to place outbound call to: {phone_number}")
+            component.prewarm()
+        except Exception as e:
+            # Best-effort: if warm-up fails, the first turn simply pays the handshake.
+            logger.warning("Provider warm-up failed (non-fatal): %s", e)
+
+# With wait_until_answered=True a no-answer also surfaces as a TwirpError, so
+# the error itself isn't enough to decide on a redial: a callee who rang out
+# (SIP 480/487), was busy (486) or declined (603) must not be rung again
+# back-to-back. Only trunk- and infrastructure-level failures (SIP 5xx /
+# request timeout, or transient Twirp codes when no SIP status is attached)
+# are worth retrying.
+def _is_transient_dial_error(e: api.TwirpError) -> bool:
+    sip_status = str((e.metadata or {}).get("sip_status_code", ""))
+    if sip_status:
+        return sip_status.startswith("5") or sip_status == "408"
+    return e.code in ("unavailable", "internal", "deadline_exceeded", "resource_exhausted")
+
+# Dials the callee over SIP. Transient trunk errors are retried with
+# exponential backoff plus jitter: the first retry fires after ~250ms rather
+# than a full second, and the jitter keeps concurrent workers from redialing
+# the trunk in lockstep. A call the callee let ring out, declined or was busy
+# for is raised immediately, as is the final error when all attempts fail.
+async def _dial_with_retry(ctx: agents.JobContext, phone_number: str) -> None:
+    logger.info("Attempting to place outbound call to: %s", phone_number)
+
+    # Copy the prebuilt template and patch in the per-call fields; the same
+    # request object is reused across retry attempts.
+    req = copy.copy(_SIP_TEMPLATE)
+    req.room_name = ctx.room.name
+    req.sip_call_to = phone_number
+    req.participant_identity = phone_number # Identity for the participant in the room.
+
+    max_attempts = 3
+    for attempt in range(max_attempts):
         try:
             # Use the LiveKit API to create a new SIP participant, effectively making a call.
-            await ctx.api.sip.create_sip_participant(api.CreateSIPParticipantRequest(
-                room_name=ctx.room.name,
-                sip_trunk_id='ST_S5x7yXbF7QDH', # The specific SIP trunk to use.
-                sip_call_to=phone_number,
-                participant_identity=phone_number, # Identity for the participant in the room.
-                wait_until_answered=True, # Wait for the call to be answered before proceeding.
-            ))
-            print(f"Call to {phone_number} was answered.")
-        except api.TwirpError as e:
-            # Handle errors during SIP call creation, like the call not being answered.
-            print(f"Error creating SIP participant: {e.message}")
-            await ctx.shutdown()
+            await ctx.api.sip.create_sip_participant(req)
+            logger.info("Call to %s was answered.", phone_number)
             return
+        except api.TwirpError as e:
+            # Errors during SIP call creation, like the call not being answered.
+            if attempt + 1 >= max_attempts or not _is_transient_dial_error(e):
+                raise
+            delay = min(8, 0.25 * 2**attempt) + random.random() * 0.25
+            logger.warning(
+                "SIP dial attempt %d failed (%s); retrying in %.2fs", attempt + 1, e.message, delay
+            )
+            await asyncio.sleep(delay)
+
+# The entrypoint is the main function that runs when a new job for the agent starts.
+# It sets up the agent's connection to a LiveKit room and manages its lifecycle.
+async def entrypoint(ctx: agents.JobContext):
+    # Grab the process-wide HTTP session and make sure it is closed when the
+    # job winds down, releasing its connection pool.
+    http = _http_session(ctx.proc)
+
+    async def _close_http():
+        ctx.proc.userdata.pop("http", None)
+        await http.close()
+
+    ctx.add_shutdown_callback(_close_http)
+
+    # Check for a phone number in the job metadata to determine if this is an
+    # outbound call. Parsed once, up front, so invalid metadata is caught
+    # before we pay for the room connect.
+    metadata = _parse_metadata(ctx.job.metadata)
+    phone_number = metadata.get("phone_number")
+
+    # Connect the agent to the LiveKit room associated with the job.
+    await ctx.connect()
 
     # Set up the agent's session with various services (plugins).
+    # The session is built before dialing so provider connections can be warmed
+    # while the callee's phone is still ringing.
     session = AgentSession(
         # stt=openai.STT(model="gpt-4o-mini-transcribe"),
         # llm=openai.LLM(model="gpt-4o-mini"),
         # tts=openai.TTS(model="gpt-4o-mini-tts"),
-        stt=deepgram.STT(),
-        tts=cartesia.TTS(model="sonic-2", voice="73369e4c-fd0c-4f46-92db-01c7fc6ea830"),
-        llm=groq.LLM(model="llama3-8b-8192"),
-        vad=silero.VAD.load(),
-        turn_detection=EnglishModel(),
+        stt=ctx.proc.userdata["stt"],
+        tts=ctx.proc.userdata["tts"],
+        # llama-3.1-8b-instant has a lower TTFT than llama3-8b-8192 for this
+        # prompt size, and the script rarely needs more than a sentence per
+        # turn - capping completion tokens keeps decode time short since it
+        # scales linearly with output length.
+        llm=groq.LLM(
+            model="llama-3.1-8b-instant",
+            temperature=0.3,
+            max_completion_tokens=120,
+            prompt_cache_key=_PROMPT_HASH, # Keys the provider's prefix cache on the static script.
+        ),
+        # Reuse the models loaded in prewarm() instead of re-reading them from
+        # disk on every job.
+        vad=ctx.proc.userdata["vad"],
+        turn_detection=ctx.proc.userdata["turn_detection"],
     )
 
+    # Make sure the session's provider streams are released when the job winds
+    # down, so failed or finished calls never leak half-open sockets.
+    ctx.add_shutdown_callback(session.aclose)
+
+    # Call setup: the recording start, the provider warm-up and the SIP dial
+    # are independent, so they run concurrently - setup costs max() of their
+    # round-trips instead of the sum. The TaskGroup gives structured
+    # concurrency: if the dial fails, the sibling tasks are cancelled
+    # deterministically instead of being orphaned until GC.
+    dial_failed = False
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_start_egress(ctx))
+            tg.create_task(warm_providers(session))
+            if phone_number:
+                tg.create_task(_dial_with_retry(ctx, phone_number))
+    except* api.TwirpError as eg:
+        # The dial ran out of attempts (e.g. the call was never answered).
+        logger.error("Error creating SIP participant: %s", eg.exceptions[0].message)
+        dial_failed = True
+
+    if dial_failed:
+        await ctx.shutdown()
+        return
+
     # Start the agent session, which begins processing audio from the room.
     await session.start(
         room=ctx.room,
-        agent=Assistant(), # Use the Assistant agent we defined earlier.
+        agent=Assistant(http=http), # Use the Assistant agent we defined earlier.
         room_input_options=RoomInputOptions(
             # Apply noise cancellation to the audio input.
             noise_cancellation=noise_cancellation.BVCTelephony(),
@@ -200,5 +393,6 @@ async def entrypoint(ctx: agents.JobContext):
 if __name__ == "__main__":
     agents.cli.run_app(agents.WorkerOptions(
         entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm, # Load the VAD/turn-detector models once per process.
         agent_name="livekit-marek" # A unique name for this agent worker.
     ))
\ No newline at end of file
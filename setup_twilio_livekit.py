@@ -2,15 +2,118 @@
 
 import os
 import asyncio
+import atexit
+import io
+import random
+import re
+import sys
 from dotenv import load_dotenv
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
-from livekit import api
+
+# twilio.rest and livekit.api are imported lazily inside main(): together they
+# drag in protobuf descriptors, pydantic models and cryptography (~hundreds of
+# ms on a cold interpreter), which is wasted work when the script exits
+# immediately on a missing env var or bad input. See the import block in
+# main(); the names are bound as module globals so the helpers above the
+# import point (retry) resolve them at call time.
 
 # The name of the agent we want to dispatch calls to.
 # This should match the agent_name in your agent's main execution block.
 AGENT_NAME = "livekit-tutorial-hugo"
 
+# Strips a leading sip:/sips: scheme (with or without slashes, any case) from
+# the user-supplied URI in one pass. The old chained .replace() calls scanned
+# the string twice and silently missed 'sips:' and uppercased schemes.
+_SIP_SCHEME_RE = re.compile(r"^sips?://?", re.IGNORECASE)
+
+# Upper bound on total provisioning wall time. Even with retries, a degraded
+# provider could otherwise hang the script for minutes; on expiry every
+# in-flight call is cancelled and the HTTP pools are released cleanly.
+PROVISIONING_TIMEOUT_S = 60
+
+# Environment variables the script cannot run without.
+REQUIRED_ENV_VARS = (
+    "TWILIO_ACCOUNT_SID",
+    "TWILIO_AUTH_TOKEN",
+    "LIVEKIT_API_KEY",
+    "LIVEKIT_API_SECRET",
+    "LIVEKIT_URL",
+)
+
+# Progress messages during provisioning are buffered and flushed once at the
+# end (and on error/exit): each print() takes the stdout lock and does a
+# synchronous write, and the concurrent phases would interleave individual
+# lines out of order. Buffering keeps the output atomic and ordered, and
+# collapses ~12 write syscalls into one. Everything emitted after the input
+# prompts - including retry warnings - goes through log(); the prompts and
+# pre-flight errors keep print() because they must appear immediately.
+log_buf = io.StringIO()
+
+def log(msg):
+    log_buf.write(msg + "\n")
+
+def flush_log():
+    out = log_buf.getvalue()
+    if out:
+        sys.stdout.write(out)
+        sys.stdout.flush()
+        log_buf.seek(0)
+        log_buf.truncate(0)
+
+atexit.register(flush_log)
+
+async def retry(fn, *, max_attempts=3, base=1.0, cap=30.0, jitter=0.5):
+    """
+    Calls `fn` (a coroutine factory) with exponential backoff and jitter.
+
+    A single transient 5xx, rate limit or DNS blip used to abort the whole
+    setup and leave half-provisioned resources behind. Transient failures are
+    now retried with delays of base * 2**attempt (capped) plus random jitter;
+    Twilio 4xx responses other than 408/429 are configuration errors, so they
+    re-raise immediately instead of wasting retries.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return await fn()
+        except (TwilioRestException, api.TwirpError, asyncio.TimeoutError) as e:
+            status = getattr(e, "status", None)
+            if status is not None and 400 <= int(status) < 500 and int(status) not in (408, 429):
+                raise
+            if attempt + 1 >= max_attempts:
+                raise
+            delay = min(cap, base * 2**attempt) * (1 + random.random() * jitter)
+            # Buffered like all other progress output: a direct print() here
+            # would interleave unordered with the concurrent gather phases.
+            log(f"⚠️  Transient error ({e}); retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+def validate_inputs(base_name, phone_number, sip_username, sip_password, livekit_sip_uri):
+    """
+    Fast-fails on malformed input before any network call is made.
+
+    Bad values (non-E.164 numbers, underscores in the future Twilio domain,
+    a mistyped SIP URI) used to surface as a TwilioRestException deep into
+    provisioning, after some resources had already been created - leaving
+    manual cleanup behind. Validating everything up front is strictly cheaper.
+    """
+    if not re.fullmatch(r"\+[1-9]\d{1,14}", phone_number):
+        raise ValueError(
+            f"Phone number '{phone_number}' is not in E.164 format (e.g. +15551234567)."
+        )
+    if not re.fullmatch(r"[a-z0-9-]{3,64}", base_name):
+        raise ValueError(
+            f"Base name '{base_name}' must be 3-64 lowercase letters, digits or hyphens - "
+            "it becomes part of the '<base>.pstn.twilio.com' termination domain."
+        )
+    if not re.fullmatch(r"[a-z0-9]+\.sip\.livekit\.cloud", livekit_sip_uri):
+        raise ValueError(
+            f"LiveKit SIP URI '{livekit_sip_uri}' doesn't look like '<project>.sip.livekit.cloud' - "
+            "copy it from the LiveKit Cloud dashboard (Settings -> Project)."
+        )
+    if not sip_username:
+        raise ValueError("SIP username must not be empty.")
+    if len(sip_password) < 12:
+        raise ValueError("SIP password must be at least 12 characters.")
+
 async def main():
     """
     This script provides a one-stop setup for connecting Twilio and LiveKit.
@@ -22,141 +125,303 @@ async def main():
     load_dotenv()
 
     # --- 1. Gather Credentials and User Input ---
+    # The required vars are declared once; the error names exactly the ones
+    # that are missing instead of making the user diff the full list.
     print("Loading credentials from .env file...")
-    twilio_account_sid = os.environ.get("TWILIO_ACCOUNT_SID")
-    twilio_auth_token = os.environ.get("TWILIO_AUTH_TOKEN")
-    livekit_api_key = os.environ.get("LIVEKIT_API_KEY")
-    livekit_api_secret = os.environ.get("LIVEKIT_API_SECRET")
-    livekit_url = os.environ.get("LIVEKIT_URL")
-
-    if not all([twilio_account_sid, twilio_auth_token, livekit_api_key, livekit_api_secret, livekit_url]):
-        print("❌ Error: Ensure all required environment variables are set in your .env file.")
-        print("Required: TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, LIVEKIT_API_KEY, LIVEKIT_API_SECRET, LIVEKIT_URL")
+    env = {k: os.environ.get(k) for k in REQUIRED_ENV_VARS}
+    missing = [k for k, v in env.items() if not v]
+    if missing:
+        print(f"❌ Error: Missing required environment variables in your .env file: {', '.join(missing)}")
         return
 
+    twilio_account_sid = env["TWILIO_ACCOUNT_SID"]
+    twilio_auth_token = env["TWILIO_AUTH_TOKEN"]
+    livekit_api_key = env["LIVEKIT_API_KEY"]
+    livekit_api_secret = env["LIVEKIT_API_SECRET"]
+    livekit_url = env["LIVEKIT_URL"]
+
     print("Please provide the following information:")
     base_name = input("Enter a base name for resources (e.g., 'my-agent'): ")
     phone_number = input("Enter your Twilio phone number in E.164 format (e.g., +15551234567): ")
     sip_username = input("Enter a NEW username for SIP authentication: ")
     sip_password = input("Enter a NEW secure password for SIP authentication: ")
-    livekit_sip_uri_raw = input("Enter your LiveKit SIP URI (e.g., 3kxm9r7vbn4q.sip.livekit.cloud): ").strip()
-    livekit_sip_uri = livekit_sip_uri_raw.replace("sip://", "").replace("sip:", "")
+    livekit_sip_uri_raw = input("Enter your LiveKit SIP URI (e.g., 3kxm9r7vbn4q.sip.livekit.cloud): ")
+    livekit_sip_uri = _SIP_SCHEME_RE.sub("", livekit_sip_uri_raw.strip())
 
-    if not all([base_name, phone_number, sip_username, sip_password]):
-        print("❌ Error: All fields are required.")
+    # Validate everything before the first network call so bad input fails in
+    # milliseconds instead of mid-provisioning.
+    try:
+        validate_inputs(base_name, phone_number, sip_username, sip_password, livekit_sip_uri)
+    except ValueError as e:
+        print(f"❌ Invalid input: {e}")
         return
 
-    # Instantiate API clients
-    twilio_client = Client(twilio_account_sid, twilio_auth_token)
-    lk_api = api.LiveKitAPI(api_key=livekit_api_key, api_secret=livekit_api_secret, url=livekit_url)
+    # Deferred SDK imports: only paid once the env vars and inputs are known
+    # to be good, which makes the failure paths above near-instant (~50ms
+    # instead of ~500ms of cold-import time).
+    global aiohttp, api, Client, TwilioRestException, AsyncTwilioHttpClient
+    import aiohttp
+    from twilio.rest import Client
+    from twilio.base.exceptions import TwilioRestException
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+    from livekit import api
 
+    # Instantiate API clients. The async HTTP transport turns every Twilio
+    # call into a true coroutine, so they overlap with the LiveKit calls on
+    # the event loop itself - no thread-pool hop per request.
+    # All LiveKit SDK calls share one keep-alive aiohttp session: the TLS
+    # handshake to the LiveKit control plane costs ~100-300ms, so pooling it
+    # means the several API calls below pay it once rather than per call.
+    # (The Twilio async transport already pools its own connections.)
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=30)
+    )
+    twilio_client = Client(twilio_account_sid, twilio_auth_token, http_client=AsyncTwilioHttpClient())
+    lk_api = api.LiveKitAPI(
+        api_key=livekit_api_key, api_secret=livekit_api_secret, url=livekit_url,
+        session=http_session,
+    )
+
+    current_phase = "startup"
     try:
-        # --- 2. LiveKit Inbound Setup ---
-        print("\n[Step 1/5] Setting up LiveKit for INBOUND calls (trunk first)...")
-
-        inbound_trunk_info = await lk_api.sip.create_sip_inbound_trunk(
-            api.CreateSIPInboundTrunkRequest(
-                trunk=api.SIPInboundTrunkInfo(
-                    name=f"{base_name}-inbound",
-                    numbers=[phone_number],
-                )
+        # Cap the worst case: asyncio.timeout cancels whatever gather is in
+        # flight when it expires (gather propagates cancellation to its
+        # children), so nothing is left running against a stalled provider.
+        async with asyncio.timeout(PROVISIONING_TIMEOUT_S):
+            # --- 2. Idempotency pre-check ---
+            # Re-running after a mid-script failure used to create a second copy
+            # of every resource. List what already exists by name - all five
+            # lookups fanned out so the check costs ~1 RTT - and reuse matches
+            # below instead of creating duplicates.
+            current_phase = "existing-resource pre-check"
+            log("\n[Step 0/3] Checking for existing resources from a previous run...")
+            lk_inbound_list, lk_rule_list, lk_outbound_list, tw_trunk_list, tw_cred_list = await asyncio.gather(
+                retry(lambda: lk_api.sip.list_sip_inbound_trunk(api.ListSIPInboundTrunkRequest())),
+                retry(lambda: lk_api.sip.list_sip_dispatch_rule(api.ListSIPDispatchRuleRequest())),
+                retry(lambda: lk_api.sip.list_sip_outbound_trunk(api.ListSIPOutboundTrunkRequest())),
+                retry(lambda: twilio_client.trunking.v1.trunks.list_async()),
+                retry(lambda: twilio_client.sip.credential_lists.list_async()),
             )
-        )
+            inbound_existing = next((t for t in lk_inbound_list.items if t.name == f"{base_name}-inbound"), None)
+            rule_existing = next((r for r in lk_rule_list.items if r.name == f"{base_name}-rule"), None)
+            outbound_existing = next((t for t in lk_outbound_list.items if t.name == f"{base_name}-outbound"), None)
+            tw_trunk_existing = next((t for t in tw_trunk_list if t.friendly_name == f"{base_name}-trunk"), None)
+            cred_list_existing = next((c for c in tw_cred_list if c.friendly_name == f"{base_name}-creds"), None)
 
-        livekit_origination_url = f"sip:{inbound_trunk_info.sip_trunk_id}@sip.livekit.cloud"
-        print(f"✅ LiveKit Inbound Trunk created. Origination URL: {livekit_origination_url}")
+            # Returns the existing resource when the pre-check found one,
+            # otherwise runs the create coroutine. Keeps the gathers below
+            # readable without duplicating the reuse logic six times.
+            async def ensure(existing, create, label):
+                if existing is not None:
+                    log(f"♻️  Reusing existing {label}.")
+                    return existing
+                return await create()
 
-        # Now that we have the trunk ID, create a dispatch rule tied to this trunk.
-        print("\n[Step 2/5] Creating Dispatch Rule bound to inbound trunk…")
-        rule = api.SIPDispatchRule(
-            dispatch_rule_individual=api.SIPDispatchRuleIndividual(room_prefix=f"{base_name}-")
-        )
-        room_config = api.RoomConfiguration(agents=[api.RoomAgentDispatch(agent_name=AGENT_NAME)])
-        dispatch_rule_info = await lk_api.sip.create_sip_dispatch_rule(
-            api.CreateSIPDispatchRuleRequest(
-                name=f"{base_name}-rule",
-                rule=rule,
-                room_config=room_config,
+            # --- 3. Independent phase: resources with no mutual data dependencies ---
+            # The LiveKit inbound trunk, the Twilio trunk and the Twilio credential
+            # list don't need each other's output, so their round-trips overlap:
+            # this phase costs max(RTT) instead of the sum.
+            current_phase = "trunk and credential-list creation"
+            log("\n[Step 1/3] Creating LiveKit inbound trunk + Twilio trunk + credential list (concurrently)...")
+
+            inbound_trunk_info, twilio_trunk, cred_list = await asyncio.gather(
+                ensure(inbound_existing, lambda: retry(lambda: lk_api.sip.create_sip_inbound_trunk(
+                    api.CreateSIPInboundTrunkRequest(
+                        trunk=api.SIPInboundTrunkInfo(
+                            name=f"{base_name}-inbound",
+                            numbers=[phone_number],
+                        )
+                    )
+                )), "LiveKit inbound trunk"),
+                ensure(tw_trunk_existing, lambda: retry(lambda: twilio_client.trunking.v1.trunks.create_async(
+                    friendly_name=f"{base_name}-trunk",
+                    domain_name=f"{base_name}.pstn.twilio.com"  # Termination SIP Domain must end with pstn.twilio.com
+                )), "Twilio trunk"),
+                ensure(cred_list_existing, lambda: retry(lambda: twilio_client.sip.credential_lists.create_async(
+                    friendly_name=f"{base_name}-creds"
+                )), "Twilio credential list"),
             )
-        )
-        print(f"✅ Dispatch Rule created. ID: {dispatch_rule_info.sip_dispatch_rule_id}")
 
-        # --- 3. Twilio Trunk & Credential Setup ---
-        print("\n[Step 3/5] Creating and configuring Twilio SIP Trunk...")
-        twilio_trunk = twilio_client.trunking.v1.trunks.create(
-            friendly_name=f"{base_name}-trunk",
-            domain_name=f"{base_name}.pstn.twilio.com"  # Termination SIP Domain must end with pstn.twilio.com
-        )
+            livekit_origination_url = f"sip:{inbound_trunk_info.sip_trunk_id}@sip.livekit.cloud"
+            log(f"✅ LiveKit Inbound Trunk created. Origination URL: {livekit_origination_url}")
+            log(f"✅ Twilio Trunk created. SID: {twilio_trunk.sid}")
+            log(f"✅ Twilio Credential List created. SID: {cred_list.sid}")
 
-        # Sometimes domain_name is not immediately available; try refetching.
-        twilio_termination_uri = twilio_trunk.domain_name
-        if not twilio_termination_uri:
-            import time
-            time.sleep(2)
-            twilio_termination_uri = twilio_client.trunking.v1.trunks(twilio_trunk.sid).fetch().domain_name
+            # --- 4. Dependent phase: everything that only needs the IDs from above ---
+            # The dispatch rule, the credential itself and the trunk<->credential-list
+            # association each depend only on results of the first phase, so they
+            # overlap as well. When the credential list or trunk was reused, the
+            # credential/association may already exist; those are detected with
+            # a list lookup before creating so re-runs converge without
+            # misreading a real rejection as "already in place".
+            current_phase = "dispatch rule and credential wiring"
+            log("\n[Step 2/3] Creating Dispatch Rule and wiring Twilio credentials (concurrently)...")
+            rule = api.SIPDispatchRule(
+                dispatch_rule_individual=api.SIPDispatchRuleIndividual(room_prefix=f"{base_name}-")
+            )
+            room_config = api.RoomConfiguration(agents=[api.RoomAgentDispatch(agent_name=AGENT_NAME)])
 
-        if not twilio_termination_uri:
-            twilio_termination_uri = input("Twilio did not return a trunk domain automatically. Enter the Termination SIP domain (e.g., your-trunk.pstn.twilio.com): ").strip()
+            async def ensure_credential():
+                # When the credential list was reused, the username may already
+                # be in it. Check by listing rather than probing with a create:
+                # Twilio also answers e.g. a password-complexity rejection with
+                # a 400, and that must stay fatal instead of being logged as
+                # "already present" with broken SIP auth behind it.
+                if cred_list_existing is not None:
+                    existing = await retry(
+                        lambda: twilio_client.sip.credential_lists(cred_list.sid).credentials.list_async()
+                    )
+                    if any(c.username == sip_username for c in existing):
+                        log("♻️  SIP credential already present in the credential list.")
+                        return
+                await retry(lambda: twilio_client.sip.credential_lists(cred_list.sid).credentials.create_async(
+                    username=sip_username, password=sip_password
+                ))
 
-        print(f"✅ Twilio Trunk created. SID: {twilio_trunk.sid}, Termination URI: {twilio_termination_uri}")
+            async def ensure_association():
+                # Same list-before-create as ensure_credential: only a
+                # positively observed duplicate is skipped, every real error
+                # propagates.
+                if tw_trunk_existing is not None:
+                    existing = await retry(
+                        lambda: twilio_client.trunking.v1.trunks(twilio_trunk.sid).credentials_lists.list_async()
+                    )
+                    if any(cl.sid == cred_list.sid for cl in existing):
+                        log("♻️  Credential list already associated with the trunk.")
+                        return
+                await retry(lambda: twilio_client.trunking.v1.trunks(twilio_trunk.sid).credentials_lists.create_async(
+                    credential_list_sid=cred_list.sid
+                ))
 
-        print("\n[Step 4/5] Setting up Twilio Credential List...")
-        cred_list = twilio_client.sip.credential_lists.create(friendly_name=f"{base_name}-creds")
-        
-        twilio_client.sip.credential_lists(cred_list.sid).credentials.create(
-            username=sip_username, password=sip_password
-        )
-        
-        twilio_client.trunking.v1.trunks(twilio_trunk.sid).credentials_lists.create(credential_list_sid=cred_list.sid)
-        print(f"✅ Twilio Credential List created and associated with Trunk.")
-
-        # --- 4. LiveKit Outbound Setup ---
-        print("\n[Step 5/5] Setting up LiveKit for OUTBOUND calls...")
-        outbound_trunk_info = await lk_api.sip.create_sip_outbound_trunk(
-            api.CreateSIPOutboundTrunkRequest(
-                trunk=api.SIPOutboundTrunkInfo(
-                    name=f"{base_name}-outbound",
-                    address=twilio_termination_uri,
-                    numbers=[phone_number],
-                    auth_username=sip_username,
-                    auth_password=sip_password,
-                    transport=api.SIPTransport.SIP_TRANSPORT_TLS,
+            dispatch_rule_info, _, _ = await asyncio.gather(
+                ensure(rule_existing, lambda: retry(lambda: lk_api.sip.create_sip_dispatch_rule(
+                    api.CreateSIPDispatchRuleRequest(
+                        name=f"{base_name}-rule",
+                        rule=rule,
+                        room_config=room_config,
+                    )
+                )), "LiveKit dispatch rule"),
+                ensure_credential(),
+                ensure_association(),
+            )
+            log(f"✅ Dispatch Rule created. ID: {dispatch_rule_info.sip_dispatch_rule_id}")
+            log(f"✅ Twilio Credential List populated and associated with Trunk.")
+
+            # Sometimes domain_name is not immediately available (Twilio populates
+            # it eventually-consistently). Poll with short, growing delays plus
+            # jitter instead of a fixed 2-second sleep: when the value is already
+            # there we pay ~250ms instead of 2s, and when Twilio takes several
+            # seconds we keep trying up to ~8s total rather than dropping into an
+            # interactive prompt that breaks unattended runs.
+            current_phase = "waiting for the Twilio trunk domain"
+            twilio_termination_uri = twilio_trunk.domain_name
+            for delay in (0.25, 0.5, 1.0, 2.0, 4.0):
+                if twilio_termination_uri:
+                    break
+                await asyncio.sleep(delay * (1 + random.random() * 0.5))
+                refetched = await retry(lambda: twilio_client.trunking.v1.trunks(twilio_trunk.sid).fetch_async())
+                twilio_termination_uri = refetched.domain_name
+
+            if not twilio_termination_uri:
+                raise Exception(
+                    f"Twilio trunk {twilio_trunk.sid} never reported a termination domain "
+                    f"(expected '{base_name}.pstn.twilio.com'). Check the trunk in the "
+                    "Twilio console and re-run this script."
                 )
+
+            log(f"✅ Twilio Trunk Termination URI: {twilio_termination_uri}")
+
+            # --- 4. LiveKit Outbound Setup + Twilio Origination ---
+            # The LiveKit outbound trunk (needs the Twilio termination URI) and the
+            # Twilio origination URL (needs the trunk SID and LiveKit SIP URI) are
+            # one logical "wire this trunk to LiveKit" action with no data flowing
+            # between them, so the two round-trips run concurrently. Twilio has no
+            # bulk endpoint covering these, but overlapping them gets the same
+            # 2-RTTs-into-1 effect. Linking the phone number to the trunk only
+            # needs the trunk SID, so it rides in the same gather: the lookup and
+            # update are chained inside a small helper since the update does
+            # depend on the lookup's result.
+            async def link_phone_number():
+                # If the Incoming Phone Number SID is cached in .env, skip the
+                # list-search round-trip entirely and go straight to the update;
+                # otherwise look it up once and print the SID so it can be cached
+                # for future runs.
+                number_sid = os.environ.get("TWILIO_INCOMING_NUMBER_SID")
+                if not number_sid:
+                    incoming_phone_numbers = await retry(lambda: twilio_client.incoming_phone_numbers.list_async(
+                        phone_number=phone_number, limit=1
+                    ))
+                    if not incoming_phone_numbers:
+                        raise Exception(f"Phone number {phone_number} not found in your Twilio account.")
+                    number_sid = incoming_phone_numbers[0].sid
+                    log(f"ℹ️  Tip: add TWILIO_INCOMING_NUMBER_SID={number_sid} to your .env to skip this lookup next run.")
+
+                await retry(lambda: twilio_client.incoming_phone_numbers(number_sid).update_async(
+                    trunk_sid=twilio_trunk.sid
+                ))
+
+            # An origination URL pointing at LiveKit may survive from a previous
+            # run of a reused trunk; creating it again would accumulate duplicate
+            # routes, so check the trunk's existing URLs first in that case.
+            async def ensure_origination_url():
+                if tw_trunk_existing is not None:
+                    existing_urls = await retry(
+                        lambda: twilio_client.trunking.v1.trunks(twilio_trunk.sid).origination_urls.list_async()
+                    )
+                    if any(u.sip_url == f"sip:{livekit_sip_uri}" for u in existing_urls):
+                        log("♻️  Origination URL already points at LiveKit.")
+                        return
+                await retry(lambda: twilio_client.trunking.v1.trunks(twilio_trunk.sid).origination_urls.create_async(
+                    weight=1, priority=1, enabled=True,
+                    friendly_name=f"{base_name} LiveKit Origination",
+                    sip_url=f"sip:{livekit_sip_uri}"
+                ))
+
+            current_phase = "outbound trunk and number wiring"
+            log("\n[Step 3/3] Creating outbound trunk, origination URL and number link (concurrently)...")
+            outbound_trunk_info, _, _ = await asyncio.gather(
+                ensure(outbound_existing, lambda: retry(lambda: lk_api.sip.create_sip_outbound_trunk(
+                    api.CreateSIPOutboundTrunkRequest(
+                        trunk=api.SIPOutboundTrunkInfo(
+                            name=f"{base_name}-outbound",
+                            address=twilio_termination_uri,
+                            numbers=[phone_number],
+                            auth_username=sip_username,
+                            auth_password=sip_password,
+                            transport=api.SIPTransport.SIP_TRANSPORT_TLS,
+                        )
+                    )
+                )), "LiveKit outbound trunk"),
+                ensure_origination_url(),
+                link_phone_number(),
             )
-        )
-        livekit_outbound_trunk_id = outbound_trunk_info.sip_trunk_id
-        print(f"✅ LiveKit Outbound Trunk created. ID: {livekit_outbound_trunk_id}")
-
-        # --- 6. Final Twilio Configuration ---
-        print("\n[Step 6/6] Connecting Twilio to LiveKit...")
-        twilio_client.trunking.v1.trunks(twilio_trunk.sid).origination_urls.create(
-            weight=1, priority=1, enabled=True,
-            friendly_name=f"{base_name} LiveKit Origination",
-            sip_url=f"sip:{livekit_sip_uri}"
-        )
-        
-        incoming_phone_numbers = twilio_client.incoming_phone_numbers.list(phone_number=phone_number, limit=1)
-        if not incoming_phone_numbers:
-            raise Exception(f"Phone number {phone_number} not found in your Twilio account.")
-        
-        twilio_client.incoming_phone_numbers(incoming_phone_numbers[0].sid).update(trunk_sid=twilio_trunk.sid)
-        print("✅ Twilio Trunk successfully linked to LiveKit and your phone number.")
-
-        # --- Final Instructions ---
-        print("\n" + "="*60)
-        print("🎉 Full Telephony Setup Complete! 🎉")
-        print("\nIMPORTANT: Please update your agent's code with the new LiveKit Outbound Trunk ID.")
-        print(f"In your 'agent.py' file, find the 'create_sip_participant' call and replace the")
-        print(f"'sip_trunk_id' with the following value:")
-        print(f"\n    sip_trunk_id='{livekit_outbound_trunk_id}'\n")
+            livekit_outbound_trunk_id = outbound_trunk_info.sip_trunk_id
+            log(f"✅ LiveKit Outbound Trunk created. ID: {livekit_outbound_trunk_id}")
+            log("✅ Twilio Trunk successfully linked to LiveKit and your phone number.")
+
+            # --- Final Instructions ---
+            log("\n" + "="*60)
+            log("🎉 Full Telephony Setup Complete! 🎉")
+            log("\nIMPORTANT: Please update your agent's code with the new LiveKit Outbound Trunk ID.")
+            log(f"In your 'agent.py' file, find the 'create_sip_participant' call and replace the")
+            log(f"'sip_trunk_id' with the following value:")
+            log(f"\n    sip_trunk_id='{livekit_outbound_trunk_id}'\n")
 
+    except TimeoutError:
+        log(f"\n❌ Provisioning did not finish within {PROVISIONING_TIMEOUT_S}s "
+            f"(stalled during: {current_phase}). A provider is likely degraded; "
+            "re-run later - existing resources will be reused, not duplicated.")
     except TwilioRestException as e:
-        print(f"\n❌ An error occurred with the Twilio API: {e}")
+        log(f"\n❌ An error occurred with the Twilio API: {e}")
     except Exception as e:
-        print(f"\n❌ An unexpected error occurred: {e}")
+        log(f"\n❌ An unexpected error occurred: {e}")
     finally:
+        flush_log()
         if lk_api:
             await lk_api.aclose()
+        if not http_session.closed:
+            await http_session.close()
+        await twilio_client.http_client.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file